@@ -1,33 +1,60 @@
 import json
+import logging
 import os
 import requests
 from openai import OpenAI
 from operator import itemgetter
 from typing import Optional, Dict, List, Any
 
-API_KEY = os.environ['DUOHUB_API_KEY']
+from completion_cache import PENDING, completion_key, get_cache, idempotency_key
+from duohub_client import PRIORITY_INTERACTIVE, error_response_headers, error_status_code, get_client
+
 OPENAI_API_KEY = os.environ['OPENAI_API_KEY']
-BASE_URL = "https://api.duohub.ai"
 
-headers = {
-    "Content-Type": "application/json",
-    "X-API-Key": API_KEY
-}
+# "context_first" puts the graph payload ahead of the history (original layout).
+# "cache_friendly" keeps a stable prefix (instructions + append-only history)
+# so the provider's automatic prompt caching can reuse it across turns.
+PROMPT_LAYOUT = os.environ.get('PROMPT_LAYOUT', 'context_first')
+SYSTEM_PROMPT = os.environ.get('SYSTEM_PROMPT', 'You are a helpful assistant.')
+
+# History window for the cache friendly layout. The window start only moves
+# in whole blocks, so the prefix stays identical for HISTORY_BLOCK turns.
+HISTORY_LIMIT = 50
+HISTORY_BLOCK = 10
+
+MODEL = "gpt-4o"
+
+# How long a retried request waits for the original one to finish
+IDEMPOTENCY_WAIT = 25.0
+
+# Upper bound for one handler run when the runtime gives no deadline (under
+# server.py). An idempotency claim must outlive the run it protects, otherwise
+# a retry could claim the key and generate a second time.
+MAX_HANDLER_DURATION = float(os.environ.get('MAX_HANDLER_DURATION', 900))
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', 60))
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+duohub = get_client()
+
+# Per-turn token usage is logged at INFO; set USAGE_LOG_LEVEL=WARNING to silence it
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get('USAGE_LOG_LEVEL', 'INFO'))
+
+client = OpenAI(api_key=OPENAI_API_KEY, timeout=OPENAI_TIMEOUT)
+
+# Opt-in via COMPLETION_CACHE=memory|sqlite; None when disabled
+completion_cache = get_cache()
 
 def get_session(session_id: str) -> Optional[Dict]:
-    """Check if a session exists"""
-    try:
-        response = requests.get(
-            f"{BASE_URL}/sessions/get/{session_id}",
-            headers=headers
-        )
-        if response.status_code == 200:
-            return response.json()
-        return None
-    except requests.exceptions.RequestException:
+    """Check if a session exists. Only a 404 means missing; throttling and
+    server errors raise so the handler doesn't start a new session"""
+    response = duohub.get(
+        f"/sessions/get/{session_id}",
+        priority=PRIORITY_INTERACTIVE
+    )
+    if response.status_code == 404:
         return None
+    response.raise_for_status()
+    return response.json()
 
 def create_session(customer_user_id: str, metadata: Optional[List] = None) -> Dict:
     """Create a new session"""
@@ -37,10 +64,10 @@ def create_session(customer_user_id: str, metadata: Optional[List] = None) -> Di
     if metadata:
         payload["metadata"] = metadata
 
-    response = requests.post(
-        f"{BASE_URL}/sessions/create",
-        headers=headers,
-        json=payload
+    response = duohub.post(
+        "/sessions/create",
+        json=payload,
+        priority=PRIORITY_INTERACTIVE
     )
     response.raise_for_status()
     return response.json()
@@ -55,10 +82,10 @@ def create_message(session_id: str, content: str, role: str, customer_user_id: O
     if customer_user_id:
         payload["customerUserID"] = customer_user_id
 
-    response = requests.post(
-        f"{BASE_URL}/messages/create",
-        headers=headers,
-        json=payload
+    response = duohub.post(
+        "/messages/create",
+        json=payload,
+        priority=PRIORITY_INTERACTIVE
     )
     response.raise_for_status()
     return response.json()
@@ -71,27 +98,27 @@ def retrieve_memory(memory_id: str, query: str, assisted: bool = True) -> Dict:
         "assisted": assisted
     }
 
-    response = requests.get(
-        f"{BASE_URL}/memory/",
-        headers=headers,
-        params=params
+    response = duohub.get(
+        "/memory/",
+        params=params,
+        priority=PRIORITY_INTERACTIVE
     )
     response.raise_for_status()
     return response.json()
 
-def list_messages(session_id: str, customer_user_id: Optional[str] = None) -> Dict:
+def list_messages(session_id: str, customer_user_id: Optional[str] = None, limit: int = 20) -> Dict:
     """List messages for a session"""
     params = {
         "sessionID": session_id,
-        "limit": 20
+        "limit": limit
     }
     if customer_user_id:
         params["customerUserID"] = customer_user_id
 
-    response = requests.get(
-        f"{BASE_URL}/messages/list",
-        headers=headers,
-        params=params
+    response = duohub.get(
+        "/messages/list",
+        params=params,
+        priority=PRIORITY_INTERACTIVE
     )
     response.raise_for_status()
     data = response.json()
@@ -113,7 +140,77 @@ def parse_to_openai_format(messages: List[Dict]) -> List[Dict]:
         for msg in messages
     ]
 
+def align_history(messages: List[Dict], total_count: Optional[int], block: int = HISTORY_BLOCK) -> List[Dict]:
+    """Trim the oldest messages so the window starts on a block boundary"""
+    if not total_count or total_count <= len(messages):
+        return messages
+    offset = total_count - len(messages)
+    start = -(-offset // block) * block
+    return messages[start - offset:]
+
+def build_messages(memory_payload: str, chat_messages: List[Dict], layout: str = PROMPT_LAYOUT) -> List[Dict]:
+    """Assemble the completion prompt from graph context and chat history"""
+    if layout != 'cache_friendly':
+        return [{"role": "system", "content": memory_payload}] + chat_messages
+
+    # Stable prefix first, volatile graph context just before the latest turn
+    history, latest = chat_messages[:-1], chat_messages[-1:]
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    messages.extend(history)
+    if memory_payload:
+        messages.append({"role": "system", "content": f"Context from graph: {memory_payload}"})
+    messages.extend(latest)
+    return messages
+
+def usage_summary(completion: Any) -> Dict:
+    """Prompt token usage, including tokens served from the prompt cache"""
+    usage = getattr(completion, 'usage', None)
+    if not usage:
+        return {}
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return {
+        'promptTokens': usage.prompt_tokens,
+        'cachedTokens': (getattr(details, 'cached_tokens', None) or 0) if details else 0,
+        'completionTokens': usage.completion_tokens
+    }
+
+def generate_completion(messages: List[Dict], model: str = MODEL, **params: Any) -> Dict:
+    """Create a completion, served from the completion cache on an exact match"""
+    key = completion_key(model, messages, **params)
+    if completion_cache:
+        cached = completion_cache.get_completion(key)
+        if cached:
+            return {'content': cached['content'], 'usage': {**cached['usage'], 'completionCacheHit': True}}
+
+    completion = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        **params
+    )
+    result = {
+        'content': completion.choices[0].message.content,
+        'usage': usage_summary(completion)
+    }
+    if completion_cache:
+        completion_cache.set_completion(key, result)
+    return result
+
+def handler_deadline(context: Any) -> float:
+    """Seconds this invocation can still run, from the Lambda context when there is one"""
+    get_remaining = getattr(context, 'get_remaining_time_in_millis', None)
+    if get_remaining:
+        return get_remaining() / 1000 + 1
+    return MAX_HANDLER_DURATION
+
+def get_idempotency_key(event: Dict[str, Any], body: Dict) -> Optional[str]:
+    """Read the client's idempotency key from the Idempotency-Key header or body"""
+    for name, value in (event.get('headers') or {}).items():
+        if name.lower() == 'idempotency-key' and value:
+            return value
+    return body.get('idempotencyKey')
+
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict:
+    claimed_key = None
     try:
         # Parse input parameters
         body = json.loads(event.get('body', '{}'))
@@ -134,6 +231,30 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict:
                 })
             }
 
+        # Replay the stored response for a retried request instead of generating again
+        request_key = get_idempotency_key(event, body)
+        if completion_cache and request_key:
+            idempotency_record = idempotency_key(request_key, customer_user_id)
+            previous = completion_cache.begin(idempotency_record, handler_deadline(context))
+            if previous == PENDING:
+                previous = completion_cache.wait(idempotency_record, IDEMPOTENCY_WAIT)
+                if previous is None:
+                    # The original request gave up its claim; only proceed if we win it
+                    previous = completion_cache.begin(idempotency_record, handler_deadline(context))
+            if previous == PENDING:
+                return {
+                    'statusCode': 409,
+                    'body': json.dumps({
+                        'error': 'A request with this idempotency key is still in progress'
+                    }),
+                    'headers': {
+                        'Retry-After': '1'
+                    }
+                }
+            if previous:
+                return previous
+            claimed_key = idempotency_record
+
         # Check if session exists or create new one
         if session_id:
             session_data = get_session(session_id)
@@ -160,24 +281,27 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict:
         )
 
         # Get chat history
-        chat_history = list_messages(session_id=session_id)
-        chat_messages = parse_to_openai_format(
-            chat_history.get('data', {}).get('messages', [])
-        )
+        if PROMPT_LAYOUT == 'cache_friendly':
+            chat_history = list_messages(session_id=session_id, limit=HISTORY_LIMIT)
+            history_data = chat_history.get('data', {})
+            history = align_history(
+                history_data.get('messages', []),
+                history_data.get('totalCount')
+            )
+        else:
+            chat_history = list_messages(session_id=session_id)
+            history = chat_history.get('data', {}).get('messages', [])
+        chat_messages = parse_to_openai_format(history)
 
         # Create completion request
-        messages = [
-            {"role": "system", "content": memory_response.get("payload", "")}
-        ]
-        messages.extend(chat_messages)
+        messages = build_messages(memory_response.get("payload", ""), chat_messages)
 
         # Get OpenAI response
-        completion = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages
-        )
+        completion = generate_completion(messages)
 
-        assistant_response = completion.choices[0].message.content
+        assistant_response = completion['content']
+        usage = completion['usage']
+        logger.info(json.dumps({'sessionID': session_id, 'promptLayout': PROMPT_LAYOUT, **usage}))
 
         # Create assistant message
         create_message(
@@ -187,15 +311,33 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict:
             customer_user_id=customer_user_id
         )
 
-        return {
+        result = {
             'statusCode': 200,
             'body': json.dumps({
                 'response': assistant_response,
-                'sessionID': session_id
+                'sessionID': session_id,
+                'usage': usage
             })
         }
+        if claimed_key:
+            completion_cache.finish(claimed_key, result)
+        return result
+
+    except requests.exceptions.RequestException as e:
+        if claimed_key:
+            completion_cache.abandon(claimed_key)
+        # Pass duohub throttling (429 + Retry-After) through instead of a 500
+        return {
+            'statusCode': error_status_code(e),
+            'body': json.dumps({
+                'error': str(e)
+            }),
+            'headers': error_response_headers(e)
+        }
 
     except Exception as e:
+        if claimed_key:
+            completion_cache.abandon(claimed_key)
         return {
             'statusCode': 500,
             'body': json.dumps({
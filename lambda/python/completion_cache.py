@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from ttl_cache import TTLCache
+
+# Marker stored under an idempotency key while the first request is running
+PENDING = {"status": "pending"}
+
+
+def completion_key(model: str, messages: List[Dict], **params: Any) -> str:
+    """Stable hash of everything that determines a completion"""
+    canonical = json.dumps(
+        {"model": model, "params": params, "messages": messages},
+        sort_keys=True,
+        separators=(',', ':'),
+        ensure_ascii=False
+    )
+    return "completion:" + hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def idempotency_key(key: str, customer_user_id: str) -> str:
+    """Scope a client supplied idempotency key to the user that sent it"""
+    return "idempotency:" + hashlib.sha256(f"{customer_user_id}:{key}".encode('utf-8')).hexdigest()
+
+
+class SQLiteBackend:
+    """
+    File backed cache, shared by every process that can see the file
+    (e.g. /tmp within a container, or an EFS mount across containers).
+    """
+
+    def __init__(self, path: str, max_entries: int = 10000, table: str = "cache"):
+        self.path = path
+        self.max_entries = max_entries
+        self.table = table
+        self.local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table} (accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        conn.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (time.time(),))
+        conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f"SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT value FROM {self.table} WHERE key = ? AND expires_at >= ?",
+                (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Dict, ttl: float) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl, now)
+            )
+            self._evict(conn)
+
+    def add(self, key: str, value: Dict, ttl: float) -> bool:
+        """Set only if absent (or expired). Returns True if the value was stored"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ? AND expires_at < ?", (key, now))
+            cursor = conn.execute(
+                f"INSERT OR IGNORE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl, now)
+            )
+            return cursor.rowcount == 1
+
+    def delete(self, key: str) -> None:
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+
+class CompletionCache:
+    """
+    Exact-match completion cache plus idempotency records.
+
+    Completions are keyed by `completion_key`; idempotency records hold the
+    full handler response so a client retry returns the first result
+    without generating (or storing messages) again. The two live in
+    separate backends so completion churn never evicts an idempotency
+    record that is still needed.
+    """
+
+    def __init__(self, backend: Any, idempotency_backend: Any, ttl: float = 300.0, idempotency_ttl: float = 3600.0):
+        self.backend = backend
+        self.idempotency_backend = idempotency_backend
+        self.ttl = ttl
+        self.idempotency_ttl = idempotency_ttl
+
+    def get_completion(self, key: str) -> Optional[Dict]:
+        return self.backend.get(key)
+
+    def set_completion(self, key: str, value: Dict) -> None:
+        self.backend.set(key, value, self.ttl)
+
+    def begin(self, key: str, pending_ttl: float) -> Optional[Dict]:
+        """
+        Claim an idempotency key. Returns None if this caller owns the
+        request, otherwise the stored response or PENDING.
+
+        `pending_ttl` must cover the longest the owner can run; a claim that
+        expires early lets a retry generate a second time.
+        """
+        if self.idempotency_backend.add(key, PENDING, pending_ttl):
+            return None
+        return self.idempotency_backend.get(key) or PENDING
+
+    def wait(self, key: str, timeout: float, interval: float = 0.25) -> Optional[Dict]:
+        """Poll until another request holding `key` finishes"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            record = self.idempotency_backend.get(key)
+            if record is None:
+                return None
+            if record != PENDING:
+                return record
+            time.sleep(interval)
+        return PENDING
+
+    def finish(self, key: str, response: Dict) -> None:
+        self.idempotency_backend.set(key, response, self.idempotency_ttl)
+
+    def abandon(self, key: str) -> None:
+        """Release a claim after a failure so the client can retry"""
+        self.idempotency_backend.delete(key)
+
+
+def get_cache() -> Optional[CompletionCache]:
+    """Build the cache configured by COMPLETION_CACHE, or None when disabled"""
+    backend_name = os.environ.get('COMPLETION_CACHE', '').lower()
+    max_entries = int(os.environ.get('COMPLETION_CACHE_SIZE', 1000))
+    idempotency_max_entries = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', 10000))
+    if backend_name == 'memory':
+        backend = TTLCache(max_entries=max_entries)
+        idempotency_backend = TTLCache(max_entries=idempotency_max_entries)
+    elif backend_name == 'sqlite':
+        path = os.environ.get('COMPLETION_CACHE_PATH', '/tmp/completion_cache.sqlite3')
+        backend = SQLiteBackend(path, max_entries=max_entries, table="completions")
+        idempotency_backend = SQLiteBackend(path, max_entries=idempotency_max_entries, table="idempotency")
+    else:
+        return None
+    return CompletionCache(
+        backend,
+        idempotency_backend,
+        ttl=float(os.environ.get('COMPLETION_CACHE_TTL', 300))
+    )
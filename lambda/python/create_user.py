@@ -1,15 +1,10 @@
 import json
-import os
 import requests
 from typing import Dict, Any, Optional
 
-API_KEY = os.environ['DUOHUB_API_KEY']
-BASE_URL = "https://api.duohub.ai"
+from duohub_client import PRIORITY_BULK, error_response_headers, error_status_code, get_client
 
-headers = {
-    "Content-Type": "application/json",
-    "X-API-Key": API_KEY
-}
+duohub = get_client()
 
 def validate_email(email: str) -> bool:
     """Basic email validation"""
@@ -45,10 +40,10 @@ def create_user(
     if phone:
         payload["phone"] = phone
 
-    response = requests.post(
-        f"{BASE_URL}/users/create",
-        headers=headers,
-        json=payload
+    response = duohub.post(
+        "/users/create",
+        json=payload,
+        priority=PRIORITY_BULK
     )
     response.raise_for_status()
     return response.json()
@@ -122,10 +117,10 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict:
 
     except requests.exceptions.RequestException as e:
         # Handle API-specific errors
-        status_code = e.response.status_code if hasattr(e, 'response') else 500
+        status_code = error_status_code(e)
         error_message = str(e)
         
-        if hasattr(e, 'response') and e.response.content:
+        if e.response is not None and e.response.content:
             try:
                 error_data = e.response.json()
                 error_message = error_data.get('message', str(e))
@@ -137,9 +132,7 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict:
             'body': json.dumps({
                 'error': error_message
             }),
-            'headers': {
-                'Content-Type': 'application/json'
-            }
+            'headers': error_response_headers(e)
         }
 
     except Exception as e:
@@ -0,0 +1,306 @@
+import email.utils
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+import requests.adapters
+
+BASE_URL = os.environ.get('DUOHUB_BASE_URL', "https://api.duohub.ai")
+
+# Lower value wins: interactive chat turns are served ahead of bulk jobs
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 5
+PRIORITY_BULK = 10
+
+# Status codes that mean "slow down" rather than "you sent a bad request"
+OVERLOAD_STATUS_CODES = (429, 503)
+
+# Methods that are safe to resend after a 503, when the first attempt may
+# already have been applied. Other methods (POST) are only retried on 429.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+# Latency above which a healthy response still counts as congestion, by path
+# prefix. Assisted memory queries are much slower than plain CRUD calls.
+DEFAULT_LATENCY_TARGET = float(os.environ.get('DUOHUB_LATENCY_TARGET', 2.0))
+LATENCY_TARGETS = {
+    '/memory/': float(os.environ.get('DUOHUB_MEMORY_LATENCY_TARGET', 10.0))
+}
+
+
+class QueueTimeout(requests.exceptions.RequestException):
+    """Raised when a request waits too long for a concurrency slot"""
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delta-seconds or HTTP-date) into seconds"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting the request start rate.
+
+    `pause` blocks every caller until a point in time, which is how a
+    Retry-After from the server is applied to the whole process.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def try_acquire(self) -> float:
+        """Take a token if one is available. Returns 0, or the seconds to wait"""
+        with self.lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self) -> None:
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter with a priority wait queue.
+
+    The limit grows by roughly one slot per window of healthy responses and
+    is cut multiplicatively on 429/503, errors, or latency above the
+    target passed in for that request.
+    Waiters are admitted in (priority, arrival) order. With a token bucket,
+    the waiter at the head of the queue also takes the rate limit token
+    before it gets a slot, so rate limited waits follow priority too and
+    never hold a slot.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        backoff_ratio: float = 0.5,
+        bucket: Optional[TokenBucket] = None
+    ):
+        self.bucket = bucket
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_ratio = backoff_ratio
+        self.in_flight = 0
+        self.waiters: list = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+
+    def _can_admit(self, ticket: tuple) -> bool:
+        return self.waiters[0] == ticket and self.in_flight < int(self.limit)
+
+    def acquire(self, priority: int = PRIORITY_DEFAULT, timeout: Optional[float] = None) -> None:
+        with self.condition:
+            ticket = (priority, next(self.counter))
+            heapq.heappush(self.waiters, ticket)
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while True:
+                wait = None
+                if self._can_admit(ticket):
+                    wait = self.bucket.try_acquire() if self.bucket else 0.0
+                    if not wait:
+                        break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self.waiters.remove(ticket)
+                    heapq.heapify(self.waiters)
+                    self.condition.notify_all()
+                    raise QueueTimeout(
+                        f"Timed out waiting for a duohub request slot (limit {int(self.limit)})"
+                    )
+                if wait is not None and (remaining is None or wait < remaining):
+                    # Rate limited at the head of the queue: wake up for the
+                    # next token, or earlier if a higher priority request arrives
+                    remaining = wait
+                self.condition.wait(remaining)
+            heapq.heappop(self.waiters)
+            self.in_flight += 1
+            # The next waiter may also fit under the limit
+            self.condition.notify_all()
+
+    def release(self, latency: float, overloaded: bool, latency_target: float = DEFAULT_LATENCY_TARGET) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+            elif latency > latency_target:
+                self.limit = max(self.min_limit, self.limit * 0.9)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class DuohubClient:
+    """
+    Shared duohub HTTP client.
+
+    Every request passes through an adaptive concurrency limiter
+    (parallelism) that also applies the token bucket (rate) in priority
+    order. Overload responses are retried after
+    the server's Retry-After when it is short enough, otherwise returned to
+    the caller unchanged so handlers can pass the 429 on.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = BASE_URL,
+        rate: float = 10.0,
+        burst: float = 20.0,
+        max_concurrency: int = 32,
+        max_retries: int = 2,
+        max_retry_wait: float = 5.0,
+        queue_timeout: float = 10.0,
+        timeout: float = 30.0,
+        latency_target: float = DEFAULT_LATENCY_TARGET,
+        latency_targets: Optional[Dict[str, float]] = None
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.headers = {
+            "Content-Type": "application/json",
+            "X-API-Key": api_key
+        }
+        # Size the connection pool to the concurrency ceiling so threads
+        # sharing this client (e.g. under server.py) reuse connections
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.bucket = TokenBucket(rate=rate, capacity=burst)
+        self.limiter = AdaptiveLimiter(max_limit=max_concurrency, bucket=self.bucket)
+        self.max_retries = max_retries
+        self.max_retry_wait = max_retry_wait
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.latency_target = latency_target
+        self.latency_targets = LATENCY_TARGETS if latency_targets is None else latency_targets
+
+    def latency_target_for(self, path: str) -> float:
+        for prefix, target in self.latency_targets.items():
+            if path.startswith(prefix):
+                return target
+        return self.latency_target
+
+    def request(self, method: str, path: str, priority: int = PRIORITY_DEFAULT, **kwargs: Any) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        headers = {**self.headers, **kwargs.pop('headers', {})}
+        latency_target = self.latency_target_for(path)
+        attempt = 0
+
+        while True:
+            self.limiter.acquire(priority, timeout=self.queue_timeout)
+            started = time.monotonic()
+            overloaded = True
+            try:
+                response = self.session.request(
+                    method,
+                    f"{self.base_url}{path}",
+                    headers=headers,
+                    **kwargs
+                )
+                overloaded = response.status_code in OVERLOAD_STATUS_CODES
+            finally:
+                self.limiter.release(time.monotonic() - started, overloaded, latency_target)
+
+            if not overloaded or attempt >= self.max_retries:
+                return response
+            # A 503 on a POST may come after the write was applied; resending
+            # it could duplicate messages or users
+            if response.status_code != 429 and method.upper() not in IDEMPOTENT_METHODS:
+                return response
+
+            delay = parse_retry_after(response.headers.get('Retry-After'))
+            if delay is None:
+                delay = min(self.max_retry_wait, 0.25 * 2 ** attempt) * random.uniform(0.5, 1.0)
+            if delay > self.max_retry_wait:
+                return response
+
+            self.bucket.pause(delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+
+_client: Optional[DuohubClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> DuohubClient:
+    """Return the process-wide client so all handlers share one limiter"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = DuohubClient(
+                api_key=os.environ['DUOHUB_API_KEY'],
+                rate=float(os.environ.get('DUOHUB_RATE_LIMIT', 10)),
+                burst=float(os.environ.get('DUOHUB_RATE_BURST', 20)),
+                max_concurrency=int(os.environ.get('DUOHUB_MAX_CONCURRENCY', 32))
+            )
+        return _client
+
+
+def error_status_code(error: requests.exceptions.RequestException) -> int:
+    """HTTP status to return for a failed duohub call"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return response.status_code
+    if isinstance(error, QueueTimeout):
+        return 503
+    return 500
+
+
+def error_response_headers(error: requests.exceptions.RequestException) -> Dict[str, str]:
+    """Response headers for a failed duohub call, forwarding Retry-After"""
+    headers = {'Content-Type': 'application/json'}
+    response = getattr(error, 'response', None)
+    if response is not None and response.headers.get('Retry-After'):
+        headers['Retry-After'] = response.headers['Retry-After']
+    return headers
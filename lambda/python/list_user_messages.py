@@ -1,15 +1,32 @@
+import base64
+import gzip
+import hashlib
 import json
 import os
 import requests
 from typing import Dict, Any, Optional
 
-API_KEY = os.environ['DUOHUB_API_KEY']
-BASE_URL = "https://api.duohub.ai"
+from ttl_cache import TTLCache
+from duohub_client import PRIORITY_DEFAULT, error_response_headers, error_status_code, get_client
 
-headers = {
-    "Content-Type": "application/json",
-    "X-API-Key": API_KEY
-}
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+duohub = get_client()
+
+# Recent pages per container, keyed by query parameters. Dashboards poll the
+# same session every few seconds, so a short TTL absorbs most of those calls.
+PAGE_CACHE_TTL = float(os.environ.get('MESSAGES_CACHE_TTL', 2))
+page_cache = TTLCache(max_entries=256)
+
+# Compressed bodies are returned base64-encoded, which API Gateway REST APIs
+# only decode when binaryMediaTypes is configured, so this is opt-in
+COMPRESS_RESPONSES = os.environ.get('COMPRESS_RESPONSES', '').lower() in ('1', 'true', 'yes')
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
 
 def validate_role(role: str) -> bool:
     """Validate if the role is valid"""
@@ -40,14 +57,86 @@ def get_messages(
         "previousToken": previous_token
     })
 
-    response = requests.get(
-        f"{BASE_URL}/messages/list",
-        headers=headers,
-        params=params
+    response = duohub.get(
+        "/messages/list",
+        params=params,
+        priority=PRIORITY_DEFAULT
     )
     response.raise_for_status()
     return response.json()
 
+def get_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    """Case-insensitive request header lookup"""
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+def page_fingerprint(data: Dict) -> str:
+    """ETag from message ids, update times and pagination, without hashing the full body"""
+    parts = [
+        f"{message.get('id')}:{message.get('updatedAt')}"
+        for message in data.get('messages', [])
+    ]
+    parts.extend([
+        str(data.get('nextToken')),
+        str(data.get('previousToken')),
+        str(data.get('totalCount', 0))
+    ])
+    return 'W/"' + hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest() + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    # Weak comparison: W/"x" and "x" match
+    strong = etag[2:] if etag.startswith('W/') else etag
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or any(
+        (tag[2:] if tag.startswith('W/') else tag) == strong for tag in candidates
+    )
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick brotli or gzip from an Accept-Encoding header"""
+    accepted = set()
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0'):
+            continue
+        accepted.add(name.strip().lower())
+    if brotli and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+def build_page_response(body: str, etag: str, accept_encoding: Optional[str]) -> Dict:
+    """200 response for a page, compressed when the client accepts it"""
+    headers = {
+        'Content-Type': 'application/json',
+        'ETag': etag,
+        'Vary': 'Accept-Encoding'
+    }
+    encoding = None
+    if COMPRESS_RESPONSES and len(body) >= MIN_COMPRESS_SIZE:
+        encoding = choose_encoding(accept_encoding)
+    if not encoding:
+        return {
+            'statusCode': 200,
+            'body': body,
+            'headers': headers
+        }
+
+    raw = body.encode('utf-8')
+    compressed = brotli.compress(raw, quality=5) if encoding == 'br' else gzip.compress(raw, compresslevel=6)
+    headers['Content-Encoding'] = encoding
+    return {
+        'statusCode': 200,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True,
+        'headers': headers
+    }
+
 def lambda_handler(event: Dict[str, Any], context: Any) -> Dict:
     try:
         # Extract query parameters
@@ -95,43 +184,59 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict:
         if next_token and previous_token:
             previous_token = None
 
-        # Get messages
-        response_data = get_messages(
-            session_id=session_id,
-            customer_user_id=customer_user_id,
-            role=role,
-            limit=limit,
-            next_token=next_token,
-            previous_token=previous_token
-        )
-
-        # Extract pagination tokens from response
-        data = response_data.get('data', {})
-        pagination = {
-            'nextToken': data.get('nextToken'),
-            'previousToken': data.get('previousToken'),
-            'totalCount': data.get('totalCount', 0)
-        }
+        # Serve recent identical polls from the per-container page cache
+        cache_key = json.dumps([session_id, customer_user_id, role, limit, next_token, previous_token])
+        page = page_cache.get(cache_key)
 
-        # Build response with pagination metadata
-        response = {
-            'messages': data.get('messages', []),
-            'pagination': pagination
-        }
+        if page is None:
+            # Get messages
+            response_data = get_messages(
+                session_id=session_id,
+                customer_user_id=customer_user_id,
+                role=role,
+                limit=limit,
+                next_token=next_token,
+                previous_token=previous_token
+            )
 
-        return {
-            'statusCode': 200,
-            'body': json.dumps(response),
-            'headers': {
-                'Content-Type': 'application/json'
+            # Extract pagination tokens from response
+            data = response_data.get('data', {})
+            pagination = {
+                'nextToken': data.get('nextToken'),
+                'previousToken': data.get('previousToken'),
+                'totalCount': data.get('totalCount', 0)
             }
-        }
+
+            # Build response with pagination metadata
+            response = {
+                'messages': data.get('messages', []),
+                'pagination': pagination
+            }
+
+            page = {
+                'etag': page_fingerprint(data),
+                'body': json.dumps(response)
+            }
+            page_cache.set(cache_key, page, PAGE_CACHE_TTL)
+
+        # The client already has this page
+        if etag_matches(get_header(event, 'If-None-Match'), page['etag']):
+            return {
+                'statusCode': 304,
+                'body': '',
+                'headers': {
+                    'ETag': page['etag'],
+                    'Vary': 'Accept-Encoding'
+                }
+            }
+
+        return build_page_response(page['body'], page['etag'], get_header(event, 'Accept-Encoding'))
 
     except requests.exceptions.RequestException as e:
-        status_code = e.response.status_code if hasattr(e, 'response') else 500
+        status_code = error_status_code(e)
         error_message = str(e)
         
-        if hasattr(e, 'response') and e.response.content:
+        if e.response is not None and e.response.content:
             try:
                 error_data = e.response.json()
                 error_message = error_data.get('message', str(e))
@@ -143,9 +248,7 @@ def lambda_handler(event: Dict[str, Any], context: Any) -> Dict:
             'body': json.dumps({
                 'error': error_message
             }),
-            'headers': {
-                'Content-Type': 'application/json'
-            }
+            'headers': error_response_headers(e)
         }
 
     except Exception as e:
@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import base64
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict
+
+from fastapi import FastAPI, Request, Response
+
+import chat_handler
+import create_user
+import list_user_messages
+
+# Worker threads per process for the (blocking) handlers. The duohub client,
+# OpenAI client and completion cache are module level, so every thread of a
+# process shares the same connection pools, limiter and cache. Worker
+# processes do not share them.
+HANDLER_THREADS = int(os.getenv("HANDLER_THREADS", "64"))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    executor = ThreadPoolExecutor(max_workers=HANDLER_THREADS, thread_name_prefix="handler")
+    asyncio.get_running_loop().set_default_executor(executor)
+    yield
+    executor.shutdown(wait=True)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+async def to_event(request: Request) -> Dict[str, Any]:
+    """Build an API Gateway (REST, proxy integration) event from a request"""
+    body = await request.body()
+    return {
+        'httpMethod': request.method,
+        'path': request.url.path,
+        'headers': dict(request.headers),
+        'queryStringParameters': dict(request.query_params) or None,
+        'pathParameters': dict(request.path_params) or None,
+        'body': body.decode('utf-8') if body else None,
+        'isBase64Encoded': False
+    }
+
+
+def to_response(result: Dict[str, Any]) -> Response:
+    """Convert a Lambda proxy response into an HTTP response"""
+    body = result.get('body') or ''
+    if result.get('isBase64Encoded'):
+        content = base64.b64decode(body)
+    else:
+        content = body.encode('utf-8')
+    headers = dict(result.get('headers') or {})
+    headers.setdefault('Content-Type', 'application/json')
+    return Response(
+        content=content,
+        status_code=result.get('statusCode', 200),
+        headers=headers
+    )
+
+
+async def invoke(handler: Callable[[Dict[str, Any], Any], Dict], request: Request) -> Response:
+    event = await to_event(request)
+    result = await asyncio.get_running_loop().run_in_executor(None, handler, event, None)
+    return to_response(result)
+
+
+@app.post("/chat")
+async def chat(request: Request):
+    return await invoke(chat_handler.lambda_handler, request)
+
+
+@app.post("/users")
+async def users(request: Request):
+    return await invoke(create_user.lambda_handler, request)
+
+
+@app.get("/messages")
+async def messages(request: Request):
+    return await invoke(list_user_messages.lambda_handler, request)
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    default_host = os.getenv("HOST", "0.0.0.0")
+    default_port = int(os.getenv("PORT", "8080"))
+    # One process by default: the handlers are I/O bound, and each extra
+    # process has its own limiter and (with COMPLETION_CACHE=memory) cache
+    default_workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+    parser = argparse.ArgumentParser(description="duohub Lambda handlers as a long-lived ASGI server")
+    parser.add_argument("--host", type=str, default=default_host, help="Host address")
+    parser.add_argument("--port", type=int, default=default_port, help="Port number")
+    parser.add_argument("--workers", type=int, default=default_workers, help="Number of worker processes")
+
+    config = parser.parse_args()
+
+    if config.workers > 1:
+        # Workers inherit the environment: split the duohub limits between
+        # them so the process group as a whole stays within them
+        for name, default in (("DUOHUB_RATE_LIMIT", 10), ("DUOHUB_RATE_BURST", 20), ("DUOHUB_MAX_CONCURRENCY", 32)):
+            total = float(os.getenv(name, default))
+            per_worker = max(1.0, total / config.workers)
+            os.environ[name] = str(int(per_worker) if name == "DUOHUB_MAX_CONCURRENCY" else per_worker)
+
+    uvicorn.run(
+        "server:app",
+        host=config.host,
+        port=config.port,
+        workers=config.workers,
+    )
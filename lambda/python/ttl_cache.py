@@ -0,0 +1,47 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class TTLCache:
+    """In-process LRU cache with per-entry TTL"""
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Dict, ttl: float) -> None:
+        with self.lock:
+            self.entries[key] = (time.time() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def add(self, key: str, value: Dict, ttl: float) -> bool:
+        """Set only if absent (or expired). Returns True if the value was stored"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] >= time.time():
+                return False
+            self.entries[key] = (time.time() + ttl, value)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
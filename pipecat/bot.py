@@ -1,13 +1,18 @@
+import argparse
 import asyncio
 import os
 import sys
 
 import aiohttp
 from dotenv import load_dotenv
+from latency import LatencyObserver, LatencyTracker
 from loguru import logger
+from media_profiles import get_profile
+from openai import AsyncOpenAI
 from runner import configure
 
 from pipecat.audio.vad.silero import SileroVADAnalyzer
+from pipecat.audio.vad.vad_analyzer import VADParams
 from pipecat.frames.frames import (
     LLMMessagesFrame
 )
@@ -24,9 +29,41 @@ load_dotenv(override=True)
 logger.remove(0)
 logger.add(sys.stderr, level="DEBUG")
 
+# How often the conversation is snapshotted when --snapshot is given
+SNAPSHOT_INTERVAL = 10
+
+# Prefetched from the graph at startup so the greeting can be personalized
+WARMUP_QUERY = "Who is this user and what do we know about them?"
+# Longest the greeting waits for the prefetch once someone has joined
+WARMUP_TIMEOUT = 2.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="duohub voice bot")
+    parser.add_argument(
+        "-p", "--profile", type=str, required=False, help="Media profile: audio, low or full"
+    )
+    parser.add_argument(
+        "-s", "--snapshot", type=str, required=False, help="Window snapshot file to save the conversation to"
+    )
+    parser.add_argument(
+        "-r", "--resume", action="store_true", help="Resume the conversation from the --snapshot file"
+    )
+    args, unknown = parser.parse_known_args()
+    return args
+
+
+async def save_snapshots(context: Window, path: str):
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        context.save(path)
 
 
 async def main():
+    args = parse_args()
+    profile = get_profile(args.profile)
+    logger.info(f"Using media profile: {profile.name}")
+
     async with aiohttp.ClientSession() as session:
         (room_url, token) = await configure(session)
 
@@ -36,11 +73,16 @@ async def main():
             "Chatbot",
             DailyParams(
                 audio_out_enabled=True,
-                camera_out_enabled=True,
-                camera_out_width=1024,
-                camera_out_height=576,
+                audio_in_sample_rate=profile.audio_in_sample_rate,
+                audio_out_sample_rate=profile.audio_out_sample_rate,
+                camera_out_enabled=profile.camera_out_enabled,
+                camera_out_width=profile.camera_out_width,
+                camera_out_height=profile.camera_out_height,
                 vad_enabled=True,
-                vad_analyzer=SileroVADAnalyzer(),
+                vad_analyzer=SileroVADAnalyzer(
+                    sample_rate=profile.audio_in_sample_rate,
+                    params=VADParams(stop_secs=profile.vad_stop_secs)
+                ),
                 transcription_enabled=True
             ),
         )
@@ -52,15 +94,42 @@ async def main():
             },
         ]
 
-        context = Window(
-            messages=messages,
-            memory_id='memoryID', ## replace with the memory ID of the graph you want to use
-            api_key=os.getenv("DUOHUB_API_KEY")
+        context = None
+        if args.resume and args.snapshot:
+            # Resume a restarted call without replaying graph queries
+            try:
+                context = Window.load(
+                    args.snapshot,
+                    api_key=os.getenv("DUOHUB_API_KEY"),
+                    summary_client=AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+                )
+            except Exception as e:
+                logger.warning(f"Could not resume from snapshot {args.snapshot}, starting a new conversation: {e}")
+        resumed = context is not None
+        if not resumed:
+            context = Window(
+                messages=messages,
+                memory_id='memoryID', ## replace with the memory ID of the graph you want to use
+                api_key=os.getenv("DUOHUB_API_KEY"),
+                summary_client=AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+            )
+
+        latency_tracker = LatencyTracker(
+            session_id=room_url,
+            sample_rate=float(os.getenv("LATENCY_SAMPLE_RATE", "1.0")),
+            export_path=os.getenv("LATENCY_LOG"),
+            vad_stop_secs=profile.vad_stop_secs
         )
+        context.latency_tracker = latency_tracker
+
+        # Start fetching the user's profile now; the bot usually starts well
+        # before the participant joins, so the greeting rarely has to wait
+        warmup_task = None if resumed else asyncio.create_task(context.warm(WARMUP_QUERY))
 
         tts = CartesiaTTSService(
             api_key=os.getenv("CARTESIA_API_KEY"),
-            voice_id="421b3369-f63f-4b03-8980-37a44df1d4e8"
+            voice_id="421b3369-f63f-4b03-8980-37a44df1d4e8",
+            sample_rate=profile.audio_out_sample_rate
         )
 
         llm = OpenAILLMService(api_key=os.getenv("OPENAI_API_KEY"), model="gpt-4o")
@@ -70,9 +139,12 @@ async def main():
         pipeline = Pipeline(
             [
                 transport.input(),
+                LatencyObserver(latency_tracker, stages={"transcript"}, starts_turns=True),
                 context_aggregator.user(),
                 llm,
+                LatencyObserver(latency_tracker, stages={"llm_first_token"}),
                 tts,
+                LatencyObserver(latency_tracker, stages={"tts_first_audio", "audio_out"}),
                 transport.output(),
                 context_aggregator.assistant(),
             ]
@@ -84,11 +156,35 @@ async def main():
         @transport.event_handler("on_first_participant_joined")
         async def on_first_participant_joined(transport, participant):
             await transport.capture_participant_transcription(participant["id"])
-            await task.queue_frames([LLMMessagesFrame(messages)])
+            if not resumed:
+                greeting = list(messages)
+                try:
+                    profile_message = await asyncio.wait_for(asyncio.shield(warmup_task), WARMUP_TIMEOUT)
+                except asyncio.TimeoutError:
+                    logger.warning("Profile prefetch not ready, greeting without it")
+                    profile_message = None
+                if profile_message:
+                    greeting.append(profile_message)
+                await task.queue_frames([LLMMessagesFrame(greeting)])
 
         runner = PipelineRunner()
 
-        await runner.run(task)
+        snapshot_task = asyncio.create_task(save_snapshots(context, args.snapshot)) if args.snapshot else None
+        completed = False
+        try:
+            await runner.run(task)
+            completed = True
+        finally:
+            latency_tracker.close()
+            if snapshot_task:
+                snapshot_task.cancel()
+                if completed:
+                    # The call is over: a snapshot left behind means the bot
+                    # stopped mid-call and may be resumed
+                    if os.path.exists(args.snapshot):
+                        os.remove(args.snapshot)
+                else:
+                    context.save(args.snapshot)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,196 @@
+import bisect
+import json
+import random
+import time
+
+from loguru import logger
+
+from pipecat.frames.frames import (
+    BotStartedSpeakingFrame,
+    Frame,
+    InterimTranscriptionFrame,
+    TextFrame,
+    TranscriptionFrame,
+    TTSAudioRawFrame,
+    UserStoppedSpeakingFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+
+# Stages of a voice-to-voice turn, in pipeline order. Each is measured in
+# milliseconds from the end of user speech (speech_end), which is the VAD stop
+# (vad_end) backdated by the VAD's stop_secs of silence.
+STAGES = [
+    "speech_end",
+    "vad_end",
+    "transcript",
+    "graph_context",
+    "llm_first_token",
+    "tts_first_audio",
+    "audio_out",
+]
+
+# Stages that can be reached before the VAD stop opens their turn
+EARLY_STAGES = {"transcript"}
+
+# Histogram bucket upper bounds in milliseconds
+BUCKETS_MS = [50, 100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000]
+
+
+class Histogram:
+    """Fixed-bucket latency histogram."""
+
+    def __init__(self, bounds: list[float] = BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def to_dict(self) -> dict:
+        labels = [f"le_{bound}" for bound in self.bounds] + ["inf"]
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 1) if self.count else None,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class LatencyTracker:
+    """Per-session voice-to-voice timing.
+
+    Stages are marked as frames pass through LatencyObserver processors
+    (and from Window for graph context). A turn is started by the VAD stop,
+    dated back to the end of speech, and exported as one JSON record once
+    audio starts playing. Stages reached before the VAD stop (often the final
+    transcript) are kept for the next turn. Only a sampled fraction of turns
+    is timed, so unsampled turns cost a single check.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        sample_rate: float = 1.0,
+        export_path: str | None = None,
+        vad_stop_secs: float = 0.0
+    ):
+        self.session_id = session_id
+        self.sample_rate = sample_rate
+        self.export_path = export_path
+        self.vad_stop_secs = vad_stop_secs
+        self.histograms = {stage: Histogram() for stage in STAGES[1:]}
+        self.turn = 0
+        self.marks: dict[str, float] | None = None
+        # Stages reached while no turn was open
+        self.early_marks: dict[str, float] = {}
+
+    def start_turn(self):
+        """Begin a turn when the VAD reports the end of user speech."""
+        if self.marks:
+            # The previous turn was interrupted before audio played
+            self._export(complete=False)
+        self.turn += 1
+        now = time.perf_counter()
+        early_marks, self.early_marks = self.early_marks, {}
+        if random.random() >= self.sample_rate:
+            self.marks = None
+            return
+        speech_end = now - self.vad_stop_secs
+        self.marks = {"speech_end": speech_end, "vad_end": now}
+        for stage, at in early_marks.items():
+            # A transcript can be final before speech is judged over
+            self.marks[stage] = max(at, speech_end)
+
+    def mark(self, stage: str):
+        """Record the first time a stage is reached in the current turn."""
+        if self.marks is None:
+            if stage in EARLY_STAGES:
+                self.early_marks.setdefault(stage, time.perf_counter())
+            return
+        if stage in self.marks:
+            return
+        self.marks[stage] = time.perf_counter()
+        if stage == "audio_out":
+            self._export(complete=True)
+
+    def _export(self, complete: bool):
+        start = self.marks["speech_end"]
+        timings = {
+            stage: round((self.marks[stage] - start) * 1000, 1)
+            for stage in STAGES[1:]
+            if stage in self.marks
+        }
+        self.marks = None
+        if complete:
+            for stage, value in timings.items():
+                self.histograms[stage].observe(value)
+        self._write({
+            "type": "turn",
+            "session_id": self.session_id,
+            "turn": self.turn,
+            "complete": complete,
+            "timings_ms": timings,
+        })
+
+    def summary(self) -> dict:
+        return {
+            "type": "session",
+            "session_id": self.session_id,
+            "turns": self.turn,
+            "histograms": {stage: histogram.to_dict() for stage, histogram in self.histograms.items()},
+        }
+
+    def close(self):
+        """Export the session's histograms."""
+        self._write(self.summary())
+
+    def _write(self, record: dict):
+        line = json.dumps(record)
+        logger.info(f"Latency: {line}")
+        if self.export_path:
+            with open(self.export_path, "a") as f:
+                f.write(line + "\n")
+
+
+class LatencyObserver(FrameProcessor):
+    """Pass-through processor that marks turn stages on a LatencyTracker.
+
+    Each observer only marks the stages it is given, so a frame type seen at
+    several points in the pipeline is timed where it matters: place one after
+    the input transport (starts_turns=True, stages={"transcript"}), one after
+    the LLM ({"llm_first_token"}) and one between TTS and the output
+    transport ({"tts_first_audio", "audio_out"}).
+    """
+
+    def __init__(self, tracker: LatencyTracker, stages: set[str], starts_turns: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        self.tracker = tracker
+        self.stages = stages
+        self.starts_turns = starts_turns
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        await super().process_frame(frame, direction)
+
+        stage = None
+        if isinstance(frame, UserStoppedSpeakingFrame):
+            if self.starts_turns:
+                self.tracker.start_turn()
+        elif isinstance(frame, TranscriptionFrame):
+            stage = "transcript"
+        elif isinstance(frame, InterimTranscriptionFrame):
+            # Partial transcripts are text too, but not LLM output
+            pass
+        elif isinstance(frame, TextFrame):
+            stage = "llm_first_token"
+        elif isinstance(frame, TTSAudioRawFrame):
+            stage = "tts_first_audio"
+        elif isinstance(frame, BotStartedSpeakingFrame):
+            stage = "audio_out"
+
+        if stage in self.stages:
+            self.tracker.mark(stage)
+
+        await self.push_frame(frame, direction)
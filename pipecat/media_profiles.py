@@ -0,0 +1,51 @@
+import os
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class MediaProfile:
+    """Transport, VAD and TTS settings for one bot session."""
+
+    name: str
+    camera_out_enabled: bool = False
+    camera_out_width: int = 0
+    camera_out_height: int = 0
+    audio_in_sample_rate: int = 16000
+    audio_out_sample_rate: int = 16000
+    # Silence before the user's turn is considered over. Shorter answers
+    # sooner but is more likely to cut off a pause mid-sentence.
+    vad_stop_secs: float = 0.8
+
+
+PROFILES = {
+    # Voice bots only send audio, so no video track is published at all. TTS
+    # is 16kHz (telephone-grade speech, a third less audio than 24kHz) and
+    # turns end after a shorter pause.
+    "audio": MediaProfile(name="audio", vad_stop_secs=0.5),
+    "low": MediaProfile(
+        name="low",
+        camera_out_enabled=True,
+        camera_out_width=640,
+        camera_out_height=360,
+        audio_out_sample_rate=24000,
+        vad_stop_secs=0.6,
+    ),
+    "full": MediaProfile(
+        name="full",
+        camera_out_enabled=True,
+        camera_out_width=1024,
+        camera_out_height=576,
+        audio_out_sample_rate=24000,
+    ),
+}
+
+DEFAULT_PROFILE = "audio"
+
+
+def get_profile(name: str | None) -> MediaProfile:
+    """Look up a media profile by name, falling back to the default."""
+    name = name or os.getenv("BOT_MEDIA_PROFILE", DEFAULT_PROFILE)
+    profile = PROFILES.get(name)
+    if profile is None:
+        raise ValueError(f"Unknown media profile: {name}. Must be one of: {', '.join(PROFILES)}")
+    return profile
@@ -1,6 +1,10 @@
 import aiohttp
+import asyncio
+import hmac
 import os
 import argparse
+import signal
+import socket
 import subprocess
 
 from contextlib import asynccontextmanager
@@ -11,24 +15,213 @@ from fastapi.responses import JSONResponse, RedirectResponse
 
 from pipecat.transports.services.helpers.daily_rest import DailyRESTHelper, DailyRoomParams
 
+from media_profiles import get_profile
+from session_registry import BotInfo, NoCapacity, RoomFull, create_registry
+
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
 
 MAX_BOTS_PER_ROOM = 1
 
-# Bot sub-process dict for status reporting and concurrency control
+# Cluster settings. With the default in-memory registry this server runs as a
+# single instance; a shared registry (REGISTRY_BACKEND / REGISTRY_PATH) lets
+# several run side by side.
+REGISTRY_BACKEND = os.getenv("REGISTRY_BACKEND", "sqlite")
+REGISTRY_PATH = os.getenv("REGISTRY_PATH", ":memory:")
+NODE_ID = os.getenv("NODE_ID", f"{socket.gethostname()}:{os.getenv('FAST_API_PORT', '7860')}")
+NODE_URL = os.getenv("NODE_URL", f"http://{socket.gethostname()}:{os.getenv('FAST_API_PORT', '7860')}")
+MAX_BOTS_PER_NODE = int(os.getenv("MAX_BOTS_PER_NODE", "20"))
+CLUSTER_SECRET = os.getenv("CLUSTER_SECRET", "")
+HEARTBEAT_INTERVAL = 5
+NODE_TTL = 3 * HEARTBEAT_INTERVAL
+# Bots of a node that has sent no heartbeat for this long are marked lost. It
+# also bounds how long a handoff restart may take.
+LOST_BOT_TIMEOUT = float(os.getenv("LOST_BOT_TIMEOUT", "60"))
+# Seconds to wait for a peer node to accept a bot
+PEER_TIMEOUT = 10
+
+registry = create_registry(REGISTRY_BACKEND, REGISTRY_PATH)
+CLUSTER_MODE = registry.shared
+
+if CLUSTER_MODE and not CLUSTER_SECRET:
+    raise RuntimeError("Cluster mode (a shared registry) requires CLUSTER_SECRET to be set")
+
+# Seconds bots get to exit after SIGTERM before they are killed
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "30"))
+# Leave bots running on shutdown for the next server with the same NODE_ID
+HANDOFF_ON_SHUTDOWN = os.getenv("HANDOFF_ON_SHUTDOWN", "").lower() in ("1", "true", "yes")
+
+# Opt-in: each bot saves its conversation to <SNAPSHOT_DIR>/<session id>.snapshot,
+# and a bot that stops mid-call is started again (up to MAX_BOT_RESTARTS times)
+# resuming from it. Snapshots hold the callers' conversations and graph context.
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "")
+MAX_BOT_RESTARTS = int(os.getenv("MAX_BOT_RESTARTS", "1"))
+
+if HANDOFF_ON_SHUTDOWN and not CLUSTER_MODE:
+    raise RuntimeError("HANDOFF_ON_SHUTDOWN requires a shared registry, not :memory:")
+
+# Bot sub-process dict (bot id -> (process, room url)) for bots on this node
 bot_procs = {}
+# Restarts so far (bot id -> count) for bots that stopped mid-call
+bot_restarts = {}
 
 daily_helpers = {}
 
+# Draining servers admit no new sessions; handoff leaves bots running on exit.
+# cleanup_task holds the running cleanup() started by /drain, so shutdown can
+# wait for it instead of starting another one.
+server_state = {"draining": False, "handoff": HANDOFF_ON_SHUTDOWN, "cleanup_task": None}
+
+
+class AdoptedProcess:
+    """Popen-like handle for a bot started by a previous server process."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.returncode = None
+
+    # The exit status of a process that is not our child cannot be read
+    UNKNOWN_RETURNCODE = -1
+
+    def poll(self):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, 0)
+            except ProcessLookupError:
+                self.returncode = self.UNKNOWN_RETURNCODE
+            except PermissionError:
+                pass
+        return self.returncode
+
+    def send_signal(self, sig: int):
+        if self.poll() is None:
+            try:
+                os.kill(self.pid, sig)
+            except ProcessLookupError:
+                self.returncode = self.UNKNOWN_RETURNCODE
 
-def cleanup():
-    # Clean up function, just to be extra safe
-    for entry in bot_procs.values():
-        proc = entry[0]
-        proc.terminate()
-        proc.wait()
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+def is_bot_process(pid: int, room_url: str) -> bool:
+    # A live pid alone may have been reused by an unrelated process, so check
+    # it is still "python3 -m bot -u <room_url> ..."
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            args = f.read().decode(errors="replace").split("\0")
+    except OSError:
+        return False
+    pairs = set(zip(args, args[1:]))
+    return ("-m", "bot") in pairs and ("-u", room_url) in pairs
+
+
+def adopt_bots():
+    # Take over bots a previous server with this NODE_ID handed off
+    for bot in registry.node_bots(NODE_ID):
+        proc = AdoptedProcess(bot.pid) if bot.pid and is_bot_process(bot.pid, bot.room_url) else None
+        if proc and proc.poll() is None:
+            bot_procs[bot.bot_id] = (proc, bot.room_url)
+            # May have been marked lost if the restart took longer than LOST_BOT_TIMEOUT
+            registry.update_bot(bot.bot_id, "running")
+            print(f"!!! Adopted bot {bot.bot_id} (pid {bot.pid}) in {bot.room_url}")
+        else:
+            registry.update_bot(bot.bot_id, "finished")
+
+
+async def cleanup(timeout: float = DRAIN_TIMEOUT):
+    # Signal every bot at once, then wait for all of them up to the deadline
+    procs = list(bot_procs.values())
+    for proc, room_url in procs:
+        if proc.poll() is None:
+            proc.terminate()
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while any(proc.poll() is None for proc, _ in procs) and loop.time() < deadline:
+        await asyncio.sleep(0.1)
+
+    for proc, room_url in procs:
+        if proc.poll() is None:
+            print(f"!!! Bot {proc.pid} in {room_url} did not exit in {timeout}s, killing it")
+            proc.kill()
+    reap_bots()
+
+
+def check_cluster_secret(request: Request):
+    # Node-to-node and admin endpoints are disabled unless a secret is configured
+    if not CLUSTER_SECRET:
+        raise HTTPException(status_code=403, detail="Cluster endpoints are disabled: CLUSTER_SECRET is not set")
+    provided = request.headers.get("X-Cluster-Secret", "")
+    if not hmac.compare_digest(provided.encode(), CLUSTER_SECRET.encode()):
+        raise HTTPException(status_code=403, detail="Invalid cluster secret")
+
+
+def heartbeat():
+    # A draining node advertises no capacity so new sessions go elsewhere
+    capacity = 0 if server_state["draining"] else MAX_BOTS_PER_NODE
+    registry.heartbeat(NODE_ID, NODE_URL, capacity)
+
+
+def snapshot_path(bot: BotInfo | None) -> str | None:
+    return os.path.join(SNAPSHOT_DIR, f"{bot.session_id}.snapshot") if SNAPSHOT_DIR and bot else None
+
+
+def reap_bots() -> list[BotInfo]:
+    # Record finished bots in the registry, which frees their slot on this
+    # node. Returns the bots that stopped mid-call and should be resumed.
+    resume = []
+    for bot_id, (proc, room_url) in list(bot_procs.items()):
+        if proc.poll() is None:
+            continue
+        del bot_procs[bot_id]
+        bot = registry.get_bot(bot_id)
+        path = snapshot_path(bot)
+        # Bots delete their snapshot when the call ends normally
+        if path and os.path.exists(path):
+            if not server_state["draining"] and bot_restarts.get(bot_id, 0) < MAX_BOT_RESTARTS:
+                bot_restarts[bot_id] = bot_restarts.get(bot_id, 0) + 1
+                resume.append(bot)
+                continue
+            os.remove(path)
+        bot_restarts.pop(bot_id, None)
+        registry.update_bot(bot_id, "finished")
+    return resume
+
+
+async def resume_bot(bot: BotInfo):
+    # Start a bot that stopped mid-call again, from its snapshot
+    print(f"!!! Bot {bot.bot_id} stopped mid-call, resuming it in {bot.room_url}")
+    try:
+        token = await daily_helpers["rest"].get_token(bot.room_url)
+        await asyncio.to_thread(spawn_bot, bot.bot_id, bot.room_url, token, bot.profile, True)
+    except Exception as e:
+        print(f"!!! Failed to resume bot {bot.bot_id}: {e!r}")
+        await asyncio.to_thread(registry.update_bot, bot.bot_id, "failed")
+        path = snapshot_path(bot)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+async def monitor():
+    # Registry calls block on SQLite, so keep them off the event loop. A
+    # failed round (e.g. "database is locked") is logged and retried, so the
+    # node keeps its heartbeat.
+    while True:
+        try:
+            for bot in await asyncio.to_thread(reap_bots):
+                await resume_bot(bot)
+            await asyncio.to_thread(heartbeat)
+            lost = await asyncio.to_thread(registry.expire_bots, LOST_BOT_TIMEOUT)
+            if lost:
+                print(f"!!! Marked {lost} bots on unresponsive nodes as lost")
+        except Exception as e:
+            print(f"!!! Registry update failed: {e!r}")
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
 
 
 @asynccontextmanager
@@ -39,9 +232,24 @@ async def lifespan(app: FastAPI):
         daily_api_url=os.getenv("DAILY_API_URL", "https://api.daily.co/v1"),
         aiohttp_session=aiohttp_session,
     )
+    daily_helpers["session"] = aiohttp_session
+    adopt_bots()
+    heartbeat()
+    monitor_task = asyncio.create_task(monitor())
     yield
+    server_state["draining"] = True
+    monitor_task.cancel()
     await aiohttp_session.close()
-    cleanup()
+    if server_state["handoff"]:
+        # Bots run in their own session, so they outlive this process. The
+        # node entry is kept, so they are not marked lost before the next
+        # server adopts them (within LOST_BOT_TIMEOUT)
+        reap_bots()
+        heartbeat()
+        print(f"!!! Handing off {len(bot_procs)} running bots")
+    else:
+        await (server_state["cleanup_task"] or cleanup())
+        registry.remove_node(NODE_ID)
 
 
 app = FastAPI(lifespan=lifespan)
@@ -55,8 +263,44 @@ app.add_middleware(
 )
 
 
+def spawn_bot(bot_id: int, room_url: str, token: str, profile_name: str, resume: bool = False):
+    # Spawn a new agent on this node, and join the user session
+    # Note: this is mostly for demonstration purposes (refer to 'deployment' in README)
+    args = ["python3", "-m", "bot", "-u", room_url, "-t", token, "-p", profile_name]
+    path = snapshot_path(registry.get_bot(bot_id))
+    if path:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        args += ["-s", path]
+        if resume:
+            args.append("-r")
+    try:
+        proc = subprocess.Popen(
+            args,
+            bufsize=1,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            # Own session: server signals don't reach bots, and bots can be
+            # handed off to the next server process
+            start_new_session=True,
+        )
+    except Exception as e:
+        registry.update_bot(bot_id, "failed")
+        raise HTTPException(status_code=500, detail=f"Failed to start subprocess: {e}")
+
+    bot_procs[bot_id] = (proc, room_url)
+    registry.update_bot(bot_id, "running", pid=proc.pid, node_id=NODE_ID)
+
+
 @app.get("/")
 async def start_agent(request: Request):
+    # Pick the media profile for this session, e.g. /?profile=full
+    try:
+        profile = get_profile(request.query_params.get("profile"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if server_state["draining"]:
+        raise HTTPException(status_code=503, detail="Server is draining", headers={"Retry-After": "1"})
+
     print(f"!!! Creating room")
     room = await daily_helpers["rest"].create_room(DailyRoomParams())
     print(f"!!! Room URL: {room.url}")
@@ -67,51 +311,97 @@ async def start_agent(request: Request):
             detail="Missing 'room' property in request data. Cannot start agent without a target room!",
         )
 
-    # Check if there is already an existing process running in this room
-    num_bots_in_room = sum(
-        1 for proc in bot_procs.values() if proc[1] == room.url and proc[0].poll() is None
-    )
-    if num_bots_in_room >= MAX_BOTS_PER_ROOM:
-        raise HTTPException(status_code=500, detail=f"Max bot limited reach for room: {room.url}")
-
     # Get the token for the room
     token = await daily_helpers["rest"].get_token(room.url)
 
     if not token:
         raise HTTPException(status_code=500, detail=f"Failed to get token for room: {room.url}")
 
-    # Spawn a new agent, and join the user session
-    # Note: this is mostly for demonstration purposes (refer to 'deployment' in README)
+    # Reserve a slot on the least-loaded live node (this one when running
+    # standalone). The shared registry enforces the room limit across nodes.
     try:
-        proc = subprocess.Popen(
-            [f"python3 -m bot -u {room.url} -t {token}"],
-            shell=True,
-            bufsize=1,
-            cwd=os.path.dirname(os.path.abspath(__file__)),
-        )
-        bot_procs[proc.pid] = (proc, room.url)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to start subprocess: {e}")
+        bot_id, node = await asyncio.to_thread(registry.reserve_bot, room.url, MAX_BOTS_PER_ROOM, NODE_TTL, profile.name)
+    except RoomFull:
+        raise HTTPException(status_code=500, detail=f"Max bot limited reach for room: {room.url}")
+    except NoCapacity:
+        raise HTTPException(status_code=503, detail="No bot capacity available")
+
+    if node.node_id == NODE_ID:
+        await asyncio.to_thread(spawn_bot, bot_id, room.url, token, profile.name)
+    else:
+        try:
+            async with daily_helpers["session"].post(
+                f"{node.url}/internal/bots",
+                json={"bot_id": bot_id, "room_url": room.url, "token": token, "profile": profile.name},
+                headers={"X-Cluster-Secret": CLUSTER_SECRET},
+                timeout=aiohttp.ClientTimeout(total=PEER_TIMEOUT),
+            ) as response:
+                response.raise_for_status()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Release the reservation so it doesn't hold the peer's slot forever
+            await asyncio.to_thread(registry.update_bot, bot_id, "failed")
+            raise HTTPException(status_code=502, detail=f"Failed to start bot on node {node.node_id}: {e}")
 
     return RedirectResponse(room.url)
 
 
-@app.get("/status/{pid}")
-def get_status(pid: int):
-    # Look up the subprocess
-    proc = bot_procs.get(pid)
+@app.post("/internal/bots")
+async def start_bot_on_node(request: Request):
+    # Called by the node that accepted the session to run the bot here
+    check_cluster_secret(request)
 
-    # If the subprocess doesn't exist, return an error
-    if not proc:
-        raise HTTPException(status_code=404, detail=f"Bot with process id: {pid} not found")
+    if server_state["draining"]:
+        raise HTTPException(status_code=503, detail="Server is draining")
 
-    # Check the status of the subprocess
-    if proc[0].poll() is None:
-        status = "running"
-    else:
-        status = "finished"
+    data = await request.json()
+    try:
+        profile = get_profile(data.get("profile"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not isinstance(data.get("bot_id"), int) or not data.get("room_url") or not data.get("token"):
+        raise HTTPException(status_code=400, detail="bot_id, room_url and token are required")
+
+    await asyncio.to_thread(spawn_bot, data["bot_id"], data["room_url"], data["token"], profile.name)
+    return JSONResponse({"bot_id": data["bot_id"], "node_id": NODE_ID})
+
+
+@app.post("/drain")
+async def drain(request: Request, handoff: bool = False):
+    # Stop admitting sessions. With handoff=true running bots are left for the
+    # next server process; otherwise they are stopped in parallel.
+    check_cluster_secret(request)
+
+    if handoff and not CLUSTER_MODE:
+        # An in-memory registry dies with this process, so nothing could adopt the bots
+        raise HTTPException(status_code=400, detail="Handoff requires a shared registry")
+
+    if handoff and server_state["cleanup_task"]:
+        raise HTTPException(status_code=409, detail="Bots are already being stopped")
+
+    server_state["draining"] = True
+    server_state["handoff"] = handoff
+    await asyncio.to_thread(heartbeat)
+    if not handoff and not server_state["cleanup_task"]:
+        server_state["cleanup_task"] = asyncio.create_task(cleanup())
 
-    return JSONResponse({"bot_id": pid, "status": status})
+    return JSONResponse({"node_id": NODE_ID, "draining": True, "handoff": handoff, "bots": len(bot_procs)})
+
+
+@app.get("/status/{bot_id}")
+def get_status(bot_id: int):
+    # Bots on this node are checked directly, others through the registry
+    entry = bot_procs.get(bot_id)
+    if entry:
+        status = "running" if entry[0].poll() is None else "finished"
+        return JSONResponse({"bot_id": bot_id, "node_id": NODE_ID, "status": status})
+
+    bot = registry.get_bot(bot_id)
+
+    # If the bot doesn't exist, return an error
+    if not bot:
+        raise HTTPException(status_code=404, detail=f"Bot with id: {bot_id} not found")
+
+    return JSONResponse({"bot_id": bot_id, "node_id": bot.node_id, "status": bot.status})
 
 
 if __name__ == "__main__":
@@ -127,6 +417,10 @@ if __name__ == "__main__":
 
     config = parser.parse_args()
 
+    # uvicorn re-imports this module as "server"; NODE_ID / NODE_URL read the
+    # port from the environment, so advertise the port actually used
+    os.environ["FAST_API_PORT"] = str(config.port)
+
     uvicorn.run(
         "server:app",
         host=config.host,
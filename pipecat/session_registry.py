@@ -0,0 +1,254 @@
+import importlib
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+
+
+class RoomFull(Exception):
+    pass
+
+
+class NoCapacity(Exception):
+    pass
+
+
+@dataclass
+class NodeInfo:
+    node_id: str
+    url: str
+    capacity: int
+    running: int
+    heartbeat_at: float
+
+    @property
+    def free(self) -> int:
+        return self.capacity - self.running
+
+
+@dataclass
+class BotInfo:
+    bot_id: int
+    node_id: str
+    room_url: str
+    pid: int | None
+    status: str
+    started_at: float
+    # Never reused, unlike bot_id with an in-memory registry; names the
+    # bot's snapshot file
+    session_id: str
+    profile: str
+
+
+class SessionRegistry(ABC):
+    """Bot and node registry shared by every server.py instance in a cluster.
+
+    Implementations must make reserve_bot atomic across every instance that
+    shares the registry, so two nodes can never both start a bot over the
+    room limit. Pick one with create_registry.
+    """
+
+    @property
+    @abstractmethod
+    def shared(self) -> bool:
+        """True if other server processes can see this registry."""
+
+    @abstractmethod
+    def heartbeat(self, node_id: str, url: str, capacity: int):
+        """Publish this node's address and capacity, and mark it alive."""
+
+    @abstractmethod
+    def remove_node(self, node_id: str):
+        pass
+
+    @abstractmethod
+    def nodes(self, max_age: float) -> list[NodeInfo]:
+        """Live nodes, least loaded first."""
+
+    @abstractmethod
+    def reserve_bot(self, room_url: str, max_per_room: int, max_age: float, profile: str) -> tuple[int, NodeInfo]:
+        """Reserve a bot slot in a room on the least-loaded live node.
+
+        The bot gets a new random session_id. Raises RoomFull if the room already has max_per_room bots, or
+        NoCapacity if every live node is full.
+        """
+
+    @abstractmethod
+    def update_bot(self, bot_id: int, status: str, pid: int | None = None, node_id: str | None = None):
+        pass
+
+    @abstractmethod
+    def expire_bots(self, max_age: float) -> int:
+        """Mark bots "lost" when their node has not sent a heartbeat for max_age.
+
+        Returns the number of bots expired.
+        """
+
+    @abstractmethod
+    def node_bots(self, node_id: str) -> list[BotInfo]:
+        """Bots a node has started that have not finished, including lost ones."""
+
+    @abstractmethod
+    def get_bot(self, bot_id: int) -> BotInfo | None:
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+
+class SQLiteRegistry(SessionRegistry):
+    """SessionRegistry backed by SQLite.
+
+    ":memory:" keeps the single-instance behaviour; a file path on local disk
+    shares the registry between server processes on the same host. The file
+    uses WAL mode, which does not work on network filesystems, so this backend
+    cannot span hosts.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=10.0, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock:
+            if self.shared:
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS nodes (
+                    node_id TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    capacity INTEGER NOT NULL,
+                    heartbeat_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS bots (
+                    bot_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    node_id TEXT NOT NULL,
+                    room_url TEXT NOT NULL,
+                    pid INTEGER,
+                    status TEXT NOT NULL,
+                    started_at REAL NOT NULL,
+                    session_id TEXT NOT NULL,
+                    profile TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS bots_room ON bots (room_url, status);
+                """
+            )
+
+    @property
+    def shared(self) -> bool:
+        return self.path != ":memory:"
+
+    def heartbeat(self, node_id: str, url: str, capacity: int):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO nodes (node_id, url, capacity, heartbeat_at) VALUES (?, ?, ?, ?)",
+                (node_id, url, capacity, time.time()),
+            )
+
+    def remove_node(self, node_id: str):
+        with self.lock:
+            self.conn.execute("DELETE FROM nodes WHERE node_id = ?", (node_id,))
+
+    def _nodes(self, max_age: float) -> list[NodeInfo]:
+        # Load is counted from the bots table, so it is exact within a transaction
+        rows = self.conn.execute(
+            """
+            SELECT n.node_id, n.url, n.capacity, n.heartbeat_at,
+                (SELECT COUNT(*) FROM bots b
+                 WHERE b.node_id = n.node_id AND b.status IN ('starting', 'running')) AS running
+            FROM nodes n
+            WHERE n.heartbeat_at >= ?
+            ORDER BY n.capacity - running DESC, n.node_id
+            """,
+            (time.time() - max_age,),
+        ).fetchall()
+        return [NodeInfo(**row) for row in rows]
+
+    def nodes(self, max_age: float) -> list[NodeInfo]:
+        with self.lock:
+            return self._nodes(max_age)
+
+    def reserve_bot(self, room_url: str, max_per_room: int, max_age: float, profile: str) -> tuple[int, NodeInfo]:
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                (count,) = self.conn.execute(
+                    "SELECT COUNT(*) FROM bots WHERE room_url = ? AND status IN ('starting', 'running')",
+                    (room_url,),
+                ).fetchone()
+                if count >= max_per_room:
+                    raise RoomFull(room_url)
+                node = next((n for n in self._nodes(max_age) if n.free > 0), None)
+                if not node:
+                    raise NoCapacity()
+                cursor = self.conn.execute(
+                    "INSERT INTO bots (node_id, room_url, status, started_at, session_id, profile) "
+                    "VALUES (?, ?, 'starting', ?, ?, ?)",
+                    (node.node_id, room_url, time.time(), uuid.uuid4().hex, profile),
+                )
+                self.conn.execute("COMMIT")
+                return cursor.lastrowid, node
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def update_bot(self, bot_id: int, status: str, pid: int | None = None, node_id: str | None = None):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE bots SET status = ?, pid = COALESCE(?, pid), node_id = COALESCE(?, node_id) WHERE bot_id = ?",
+                (status, pid, node_id, bot_id),
+            )
+
+    def expire_bots(self, max_age: float) -> int:
+        with self.lock:
+            cursor = self.conn.execute(
+                """
+                UPDATE bots SET status = 'lost'
+                WHERE status IN ('starting', 'running') AND node_id NOT IN (
+                    SELECT node_id FROM nodes WHERE heartbeat_at >= ?
+                )
+                """,
+                (time.time() - max_age,),
+            )
+        return cursor.rowcount
+
+    def node_bots(self, node_id: str) -> list[BotInfo]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM bots WHERE node_id = ? AND status IN ('starting', 'running', 'lost')",
+                (node_id,),
+            ).fetchall()
+        return [BotInfo(**row) for row in rows]
+
+    def get_bot(self, bot_id: int) -> BotInfo | None:
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM bots WHERE bot_id = ?", (bot_id,)).fetchone()
+        return BotInfo(**row) if row else None
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# Built-in backends by name; REGISTRY_BACKEND may also be "module:ClassName"
+# for a SessionRegistry implementation elsewhere (e.g. one backed by a
+# database that every host can reach)
+BACKENDS = {"sqlite": SQLiteRegistry}
+
+
+def create_registry(backend: str, path: str) -> SessionRegistry:
+    """Build the registry backend configured by name, passing it path."""
+    if backend in BACKENDS:
+        cls = BACKENDS[backend]
+    elif ":" in backend:
+        module_name, class_name = backend.split(":", 1)
+        cls = getattr(importlib.import_module(module_name), class_name)
+    else:
+        raise ValueError(f"Unknown registry backend: {backend}. Use one of: {', '.join(BACKENDS)}, or module:ClassName")
+    if not (isinstance(cls, type) and issubclass(cls, SessionRegistry)):
+        raise ValueError(f"Registry backend {backend} is not a SessionRegistry")
+    return cls(path)
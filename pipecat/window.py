@@ -1,8 +1,13 @@
+import asyncio
 import io
 import json
 import logging
+import mmap
+import os
+import struct
 from typing import List, Iterator
 from duohub import Duohub
+from openai import AsyncOpenAI
 from openai._types import NOT_GIVEN, NotGiven
 from openai.types.chat import (
     ChatCompletionToolParam,
@@ -18,6 +23,13 @@ class CustomEncoder(json.JSONEncoder):
             return (f"{obj.getbuffer()[0:8].hex()}...")
         return super().default(obj)
 
+# Snapshot layout: magic, format version, header length, JSON header, then
+# one length-prefixed JSON record per message
+SNAPSHOT_MAGIC = b"DHWS"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_PREFIX = struct.Struct("<4sHI")
+SNAPSHOT_RECORD = struct.Struct("<I")
+
 class Window:
     def __init__(
         self,
@@ -26,7 +38,10 @@ class Window:
         tool_choice: ChatCompletionToolChoiceOptionParam | NotGiven = NOT_GIVEN,
         memory_id: str | None = None,
         api_key: str | None = None,
-        system_prompt: str = "You are a helpful assistant."
+        system_prompt: str = "You are a helpful assistant.",
+        window_size: int = 10,
+        summary_client: AsyncOpenAI | None = None,
+        summary_model: str = "gpt-4o-mini"
     ):
         """Initialize a Window instance for managing chat messages and tools.
 
@@ -37,6 +52,10 @@ class Window:
             memory_id: ID for memory context
             api_key: API key for Duohub
             system_prompt: System prompt message
+            window_size: Number of recent messages sent to the LLM
+            summary_client: OpenAI client used to fold messages that leave the
+                window into a rolling summary. Summarization is off if None.
+            summary_model: Model used for the rolling summary
         """
         logger.info(f"Initializing Window with memory_id: {memory_id}")
         self.api_key = api_key
@@ -53,6 +72,17 @@ class Window:
         self.tools: List[ChatCompletionToolParam] | NotGiven = tools
         self.duohub_client = Duohub(api_key=self.api_key)
         self.memory_id = memory_id
+
+        self.window_size = window_size
+        self.summary_client = summary_client
+        self.summary_model = summary_model
+        self.summary = ""
+        # Number of leading messages already folded into the summary
+        self.summarized_count = 0
+        self._summary_task: asyncio.Task | None = None
+
+        # Optional latency.LatencyTracker, marked when graph context is ready
+        self.latency_tracker = None
         
         logger.debug(f"Initial message count: {len(self.messages)}")
         logger.debug(f"Tool choice: {self.tool_choice}")
@@ -81,6 +111,111 @@ class Window:
         logger.debug(f"Created Window with {len(context.messages)} messages")
         return context
 
+    def snapshot(self) -> bytes:
+        """Serialize messages, graph context and summary state to bytes.
+
+        Graph context is stored as the system messages already in the
+        history, so restoring never queries duohub again.
+
+        Returns:
+            bytes: Snapshot that can be passed to Window.restore
+        """
+        header = json.dumps({
+            "memory_id": self.memory_id,
+            "system_message": self.system_message,
+            "window_size": self.window_size,
+            "summary": self.summary,
+            "summarized_count": self.summarized_count,
+            "message_count": len(self.messages)
+        }).encode("utf-8")
+        parts = [SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)), header]
+        for message in self.messages:
+            record = json.dumps(message, cls=CustomEncoder).encode("utf-8")
+            parts.append(SNAPSHOT_RECORD.pack(len(record)))
+            parts.append(record)
+        return b"".join(parts)
+
+    def save(self, path: str):
+        """Write a snapshot to path atomically.
+
+        Args:
+            path: File to write
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.snapshot())
+        os.replace(tmp_path, path)
+        logger.info(f"Saved Window snapshot with {len(self.messages)} messages to {path}")
+
+    @staticmethod
+    def restore(
+        data: bytes | memoryview | mmap.mmap,
+        api_key: str | None = None,
+        summary_client: AsyncOpenAI | None = None
+    ) -> "Window":
+        """Create a Window from a snapshot without replaying add_message.
+
+        Args:
+            data: Snapshot bytes, or any buffer such as an mmap
+            api_key: API key for Duohub
+            summary_client: OpenAI client for the rolling summary
+
+        Returns:
+            Window: Window with the snapshot's messages and summary state
+        """
+        # Released on errors too, or closing an mmap source would fail
+        with memoryview(data) as view:
+            magic, version, header_length = SNAPSHOT_PREFIX.unpack_from(view, 0)
+            if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+                raise ValueError(f"Unsupported Window snapshot (magic {magic!r}, version {version})")
+            offset = SNAPSHOT_PREFIX.size
+            header = json.loads(bytes(view[offset:offset + header_length]))
+            offset += header_length
+
+            messages = []
+            for _ in range(header["message_count"]):
+                (length,) = SNAPSHOT_RECORD.unpack_from(view, offset)
+                offset += SNAPSHOT_RECORD.size
+                if offset + length > len(view):
+                    raise ValueError("Truncated Window snapshot")
+                messages.append(json.loads(bytes(view[offset:offset + length])))
+                offset += length
+
+        context = Window(
+            messages=messages,
+            memory_id=header["memory_id"],
+            api_key=api_key,
+            system_prompt=header["system_message"]["content"],
+            window_size=header["window_size"],
+            summary_client=summary_client
+        )
+        context.summary = header["summary"]
+        context.summarized_count = header["summarized_count"]
+        logger.info(f"Restored Window with {len(messages)} messages")
+        return context
+
+    @staticmethod
+    def load(
+        path: str,
+        api_key: str | None = None,
+        summary_client: AsyncOpenAI | None = None
+    ) -> "Window":
+        """Restore a Window from a snapshot file using a memory-mapped read.
+
+        Args:
+            path: Snapshot file written by Window.save
+            api_key: API key for Duohub
+            summary_client: OpenAI client for the rolling summary
+
+        Returns:
+            Window: Restored Window instance
+        """
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                raise ValueError(f"Empty Window snapshot: {path}")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return Window.restore(mapped, api_key=api_key, summary_client=summary_client)
+
     def add_message(self, message: ChatCompletionMessageParam):
         logger.debug(f"Adding message: {message['role']} - {message.get('content', '')[:50]}...")
         self.messages.append(message)
@@ -94,15 +229,109 @@ class Window:
                 }
                 self.messages.append(context_message)
                 logger.info(f"Added Duohub context to messages: {context_message}")
+            if self.latency_tracker:
+                self.latency_tracker.mark("graph_context")
 
         logger.info(f"Total messages after addition: {len(self.messages)}")
+        self._schedule_summary()
+
+    async def warm(self, query: str) -> ChatCompletionMessageParam | None:
+        """Fetch a customer profile from the graph before the first turn.
+
+        Runs the blocking duohub query in a thread, which also opens the
+        client's connection so the first user turn does not pay for it.
+
+        Args:
+            query: Graph query describing what to prefetch
+
+        Returns:
+            The profile context message, or None if nothing was found or
+            the conversation started before it arrived
+        """
+        if not self.memory_id:
+            return None
+        try:
+            duohub_response = await asyncio.to_thread(
+                self.duohub_client.query, query=query, memoryID=self.memory_id, assisted=True
+            )
+        except Exception as e:
+            logger.warning(f"Failed to prefetch profile context: {e}")
+            return None
+        if not (duohub_response and isinstance(duohub_response, dict) and duohub_response.get('payload')):
+            return None
+        context_message = {
+            "role": "system",
+            "content": f"Context from graph about the user: {duohub_response['payload']}"
+        }
+        if any(message['role'] == 'user' for message in self.messages):
+            # Too late: each user turn already brings its own graph context
+            logger.info("Profile context arrived after the first user turn, dropping it")
+            return None
+        # Keep it with the initial system messages, ahead of a greeting that
+        # may have been sent without it
+        position = next(
+            (i for i, message in enumerate(self.messages) if message['role'] != 'system'),
+            len(self.messages)
+        )
+        self.messages.insert(position, context_message)
+        logger.info(f"Prefetched profile context: {context_message['content'][:50]}...")
+        return context_message
+
+    def _schedule_summary(self):
+        """Start a background summary update if messages have left the window."""
+        if not self.summary_client or len(self.messages) - self.window_size <= self.summarized_count:
+            return
+        if self._summary_task and not self._summary_task.done():
+            # The running task picks up new messages before it exits
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._summary_task = loop.create_task(self._update_summary())
+
+    async def _update_summary(self):
+        """Fold messages that fell out of the window into the rolling summary."""
+        while len(self.messages) - self.window_size > self.summarized_count:
+            end = len(self.messages) - self.window_size
+            evicted = [
+                f"{message['role']}: {message.get('content', '')}"
+                for message in self.messages[self.summarized_count:end]
+                if message['role'] in ('user', 'assistant') and isinstance(message.get('content'), str)
+            ]
+            if evicted:
+                try:
+                    response = await self.summary_client.chat.completions.create(
+                        model=self.summary_model,
+                        messages=[
+                            {
+                                "role": "system",
+                                "content": "Update the running summary of a conversation with the new messages. Keep every fact the user stated about themselves, their requests and any decisions made. Reply with the updated summary only, in a few short sentences."
+                            },
+                            {
+                                "role": "user",
+                                "content": f"Current summary:\n{self.summary or '(empty)'}\n\nNew messages:\n" + "\n".join(evicted)
+                            }
+                        ]
+                    )
+                except Exception as e:
+                    logger.warning(f"Failed to update conversation summary: {e}")
+                    return
+                self.summary = response.choices[0].message.content or self.summary
+                logger.info(f"Updated conversation summary: {self.summary[:50]}...")
+            self.summarized_count = end
 
     def get_messages(self) -> List[ChatCompletionMessageParam]:
         logger.debug("Retrieving messages")
         messages = [self.system_message]
+        if self.summary:
+            messages.append({
+                "role": "system",
+                "content": f"Summary of the earlier conversation: {self.summary}"
+            })
         
-        # Add at least 10 messages from the history, or all if less than 10
-        history_messages = self.messages[-10:] if len(self.messages) > 10 else self.messages
+        # Add the most recent window_size messages, or all if there are fewer
+        history_messages = self.messages[-self.window_size:] if len(self.messages) > self.window_size else self.messages
         messages.extend(history_messages)
         
         logger.info(f"Retrieved {len(messages)} messages")